@@ -1,9 +1,17 @@
 import streamlit as st
 import pandas as pd
-import xml.etree.ElementTree as ET
+import numpy as np
+import lxml.etree as ET
 import requests
-from io import StringIO
+from requests.adapters import HTTPAdapter
+import os
+import re
+import threading
+import zipfile
+from io import BytesIO
 from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Essayer d'importer chardet, mais continuer sans si non disponible
 try:
@@ -12,6 +20,34 @@ try:
 except ImportError:
     CHARDET_AVAILABLE = False
 
+# Balises pouvant contenir le numéro de commande, par ordre de priorité
+ORDER_TAGS = (
+    "OrderNumber",
+    "CommandNumber",
+    "NumeroCommande",
+    "ContractNumber",
+    "Reference",
+    "NumCommande",
+    "OrderId",
+    "CommandeId"
+)
+
+# Balises relevées pendant le parsing : numéros de commande et section à corriger
+PARSED_TAGS = ORDER_TAGS + ("PositionCharacteristics",)
+
+# Attributs pouvant contenir le numéro de commande, par ordre de priorité
+ORDER_ATTRS = ('orderNumber', 'commandNumber', 'numero', 'ref', 'id', 'order', 'commande')
+
+# Types génériques désignant un numéro de commande (ex: <Id type="order">)
+ORDER_TYPES = ('order', 'commande')
+
+# Éléments typés ou portant un attribut de commande, en un seul parcours de l'arbre
+ORDER_FALLBACK_XPATH = ET.XPath(
+    "descendant-or-self::*["
+    + " or ".join([f"@type='{t}'" for t in ORDER_TYPES] + [f"@{attr}" for attr in ORDER_ATTRS])
+    + "]"
+)
+
 st.set_page_config(page_title="Correcteur XML Boehringer", page_icon="🔧", layout="wide")
 
 # En-tête avec explication
@@ -29,42 +65,233 @@ Cette application corrige automatiquement les fichiers XML de contrats Boehringe
 """)
 st.markdown("---")
 
+# Trouver la colonne numéro de commande (nom flexible)
+def find_num_col(df):
+    """Retourne le nom de la colonne numéro de commande, ou None"""
+    for col in df.columns:
+        if 'num' in col.lower() and 'commande' in col.lower():
+            return col
+    return None
+
+# Données d'une commande utilisées pour corriger les XML
+Commande = namedtuple('Commande', ['Statut', 'StatutCode', 'Classification', 'HRBP', 'CodeAgence'])
+
+# Indexer les commandes par numéro pour une recherche directe
+def build_commandes_lookup(df, num_col):
+    """Construit un dictionnaire {numéro de commande: Commande}"""
+    if not num_col:
+        return {}
+    
+    # En cas de doublon, la première ligne fait foi
+    unique_df = df.dropna(subset=[num_col]).drop_duplicates(subset=num_col, keep='first')
+    
+    # Colonnes utiles (noms flexibles), valeur vide si la colonne est absente
+    def column(keyword):
+        col = next((c for c in unique_df.columns if keyword in c.lower()), None)
+        return unique_df[col] if col else pd.Series('', index=unique_df.index, dtype=object)
+    
+    # Code du statut calculé une fois par commande (ex: "N2" de "N2 - Niveau 2 (4B +)")
+    statuts = column('statut')
+    codes = statuts.str.split(n=1).str[0].fillna('')
+    
+    commandes = map(Commande._make, zip(
+        statuts.tolist(),
+        codes.tolist(),
+        column('class').tolist(),
+        column('hrbp').tolist(),
+        column('agence').tolist()
+    ))
+    return dict(zip(unique_df[num_col].tolist(), commandes))
+
+# Statistiques affichées, calculées une fois avec l'index
+def build_commandes_stats(lookup):
+    """Compte les commandes, agences et HRBP distincts"""
+    def distinct(field):
+        values = (getattr(commande, field) for commande in lookup.values())
+        # Les cellules vides du CSV arrivent en NaN : seules les chaînes non vides comptent
+        return len({value for value in values if isinstance(value, str) and value})
+    
+    return {
+        'total': len(lookup),
+        'agences': distinct('CodeAgence'),
+        'hrbp': distinct('HRBP')
+    }
+
+# Session HTTP partagée entre les utilisateurs : les connexions sont réutilisées
+@st.cache_resource
+def get_http_session():
+    """Retourne une session requests avec un pool de connexions"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+    return session
+
+# Dernière version téléchargée du CSV, pour les requêtes conditionnelles
+@st.cache_resource
+def get_csv_state():
+    """Retourne le dernier ETag reçu et les données chargées avec"""
+    return {'etag': None, 'data': None}
+
 # Charger les données depuis GitHub
 @st.cache_data(ttl=300)
 def load_data_from_github():
     try:
         url = "https://raw.githubusercontent.com/younessemlali/xml-boehringer-corrector/main/commandes.csv"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            df = pd.read_csv(StringIO(response.text))
-            
-            # Debug : afficher les colonnes trouvées
-            print(f"Colonnes trouvées: {list(df.columns)}")
-            
-            # Chercher la colonne numéro de commande (flexible)
-            num_col = None
-            for col in df.columns:
-                if 'num' in col.lower() and 'commande' in col.lower():
-                    num_col = col
-                    break
-            
-            # S'assurer que les numéros gardent leurs zéros
-            if num_col:
-                df[num_col] = df[num_col].astype(str).str.zfill(6)
+        
+        # Requête conditionnelle : si le CSV n'a pas changé, GitHub répond 304 sans contenu
+        csv_state = get_csv_state()
+        headers = {'If-None-Match': csv_state['etag']} if csv_state['etag'] else {}
+        
+        with get_http_session().get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code == 304 and csv_state['data'] is not None:
+                # CSV inchangé : on repart du DataFrame déjà lu
+                df, num_col = csv_state['data']
+            elif response.status_code == 200:
+                # Lecture en flux depuis la connexion, toutes colonnes en texte :
+                # les numéros de commande ne sont pas convertis en entiers
+                response.raw.decode_content = True
+                df = pd.read_csv(response.raw, dtype=str)
                 
-            return df, None
-        else:
-            return None, f"Erreur HTTP {response.status_code}"
+                # Debug : afficher les colonnes trouvées
+                print(f"Colonnes trouvées: {list(df.columns)}")
+                
+                # Chercher la colonne numéro de commande (une seule fois, résultat en cache)
+                num_col = find_num_col(df)
+                
+                # S'assurer que les numéros gardent leurs zéros
+                if num_col:
+                    df[num_col] = df[num_col].str.zfill(6)
+                
+                csv_state['etag'] = response.headers.get('ETag')
+                csv_state['data'] = (df, num_col)
+            else:
+                return None, None, None, None, f"Erreur HTTP {response.status_code}"
+        
+        # L'index est reconstruit à chaque exécution : les Commande sont
+        # recréées avec la classe courante du script
+        lookup = build_commandes_lookup(df, num_col)
+        return df, num_col, lookup, build_commandes_stats(lookup), None
     except Exception as e:
-        return None, f"Erreur: {str(e)}"
+        return None, None, None, None, f"Erreur: {str(e)}"
+
+# Séquences de chiffres dans les octets bruts d'un fichier
+DIGIT_RUN = re.compile(rb'\d+')
+
+# Préparer les numéros connus pour le pré-filtre des fichiers
+def build_order_needles(lookup):
+    """Retourne les numéros connus sans zéros de tête, et les numéros non numériques"""
+    digits = set()
+    others = []
+    for num in lookup:
+        if num.isdigit():
+            # Le XML peut contenir le numéro sans ses zéros (ex: 54 pour 000054)
+            digits.add(num.lstrip('0').encode())
+        else:
+            others.append(num.encode())
+    return digits, others
+
+# Pré-filtre sur les octets bruts, avant tout parsing XML
+def may_contain_known_order(xml_bytes, needles):
+    """Indique si un numéro de commande connu peut apparaître dans le fichier"""
+    digits, others = needles
+    
+    # Encodages sur plusieurs octets (UTF-16, UTF-32) : pas de pré-filtre possible
+    if b'\x00' in xml_bytes[:4]:
+        return True
+    
+    if any(needle in xml_bytes for needle in others):
+        return True
+    
+    # Un seul parcours du fichier, quel que soit le nombre de commandes connues
+    return any(run.lstrip(b'0') in digits for run in DIGIT_RUN.findall(xml_bytes))
+
+# Parsers XML par thread, réutilisés d'un fichier à l'autre
+_parser_local = threading.local()
+
+def get_xml_parser(encoding=None):
+    """Retourne le parser XML du thread courant pour cet encodage, créé au premier appel"""
+    parsers = getattr(_parser_local, 'parsers', None)
+    if parsers is None:
+        parsers = _parser_local.parsers = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        # Parser en flux : signale les balises de commande pendant la lecture.
+        # Sans encodage imposé, lxml suit la déclaration XML ou le BOM du fichier.
+        # Le DOCTYPE n'est pas réécrit après correction : les entités internes
+        # doivent être développées au parsing (les entités externes restent bloquées).
+        parser = ET.XMLPullParser(
+            events=('end',),
+            tag=PARSED_TAGS,
+            encoding=encoding,
+            huge_tree=True,
+            collect_ids=False,
+            resolve_entities='internal',
+            no_network=True,
+            remove_blank_text=False
+        )
+        parsers[encoding] = parser
+    return parser
+
+def read_xml(parser, data):
+    """Alimente le parser et retourne la racine et le premier élément de chaque balise suivie"""
+    try:
+        # Le parsing en flux relève au passage la première occurrence de chaque
+        # balise suivie, ce qui évite de reparcourir l'arbre ensuite.
+        # L'arbre est conservé en entier : il doit être réécrit après correction.
+        parser.feed(data)
+        tag_hits = {}
+        for _, elem in parser.read_events():
+            if elem.tag not in tag_hits:
+                tag_hits[elem.tag] = elem
+        return parser.close(), tag_hits
+    except ET.XMLSyntaxError:
+        # Vider les événements et l'état restants pour ne pas polluer le fichier suivant
+        for _ in parser.read_events():
+            pass
+        try:
+            parser.close()
+        except ET.XMLSyntaxError:
+            pass
+        raise
+
+# Encodage annoncé dans la déclaration XML, en tête de fichier
+XML_DECL_ENCODING = re.compile(rb'^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+# Encodages compatibles avec une lecture directe en UTF-8
+UTF8_ENCODINGS = (b'utf-8', b'utf8', b'us-ascii', b'ascii')
+
+def can_parse_raw(xml_bytes):
+    """Indique si les octets bruts peuvent être confiés à lxml sans risque de mauvais décodage"""
+    match = XML_DECL_ENCODING.match(xml_bytes[:200])
+    if match is None or match.group(1).lower() in UTF8_ENCODINGS:
+        return True
+    
+    # Encodage mono-octet déclaré (ISO-8859-1, windows-1252...) : tout octet y est
+    # valide, lxml ne signalerait donc pas un fichier en réalité en UTF-8.
+    # La déclaration n'est suivie que si le contenu n'est pas de l'UTF-8 valide.
+    try:
+        xml_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        return True
+    return False
 
 # Fonction améliorée pour parser un XML avec gestion des encodages
 def parse_xml_content(xml_content):
-    """Parse le contenu XML et retourne la racine"""
+    """Parse le contenu XML et retourne la racine et les balises suivies rencontrées"""
     try:
         if isinstance(xml_content, str):
             content = xml_content
         else:
+            content = None
+            
+            # Octets bruts donnés tels quels à lxml : pas de décodage puis ré-encodage
+            if can_parse_raw(xml_content):
+                try:
+                    root, tag_hits = read_xml(get_xml_parser(), xml_content)
+                    return root, tag_hits, None
+                except ET.XMLSyntaxError:
+                    # Octets invalides pour l'encodage déclaré : détection ci-dessous
+                    pass
+            
             # Si chardet est disponible, l'utiliser
             if CHARDET_AVAILABLE:
                 try:
@@ -74,8 +301,6 @@ def parse_xml_content(xml_content):
                 except:
                     # Si chardet échoue, passer au fallback
                     content = None
-            else:
-                content = None
             
             # Fallback : essayer différents encodages
             if content is None:
@@ -92,33 +317,32 @@ def parse_xml_content(xml_content):
                     # En dernier recours, ignorer les erreurs
                     content = xml_content.decode('utf-8', errors='ignore')
         
-        root = ET.fromstring(content)
-        return root, None
+        # Le contenu est déjà décodé : on le ré-encode en UTF-8 et on force
+        # l'encodage du parser pour ignorer la déclaration XML d'origine
+        root, tag_hits = read_xml(get_xml_parser('utf-8'), content.encode('utf-8'))
+        return root, tag_hits, None
     except Exception as e:
-        return None, str(e)
+        return None, None, str(e)
 
 # Fonction pour trouver le numéro de commande
-def find_order_number(root):
+def find_order_number(root, tag_hits):
     """Recherche le numéro de commande dans le XML"""
-    search_paths = [
-        ("OrderNumber", ".//OrderNumber"),
-        ("CommandNumber", ".//CommandNumber"),
-        ("NumeroCommande", ".//NumeroCommande"),
-        ("ContractNumber", ".//ContractNumber"),
-        ("Reference", ".//Reference"),
-        ("NumCommande", ".//NumCommande"),
-        ("OrderId", ".//OrderId"),
-        ("CommandeId", ".//CommandeId")
-    ]
-    
-    for tag_name, path in search_paths:
-        elem = root.find(path)
+    # Balises relevées pendant le parsing, par ordre de priorité
+    for tag_name in ORDER_TAGS:
+        elem = tag_hits.get(tag_name)
         if elem is not None and elem.text:
             return elem.text.strip().zfill(6), tag_name
     
+    candidates = ORDER_FALLBACK_XPATH(root)
+    
+    # Éléments typés, premier trouvé dans l'ordre du document
+    for elem in candidates:
+        if elem.get('type') in ORDER_TYPES and elem.text and elem.text.strip():
+            return elem.text.strip().zfill(6), f"{elem.tag}[@type='{elem.get('type')}']"
+    
     # Recherche dans les attributs si pas trouvé dans les éléments
-    for elem in root.iter():
-        for attr in ['orderNumber', 'commandNumber', 'numero', 'ref', 'id', 'order', 'commande']:
+    for elem in candidates:
+        for attr in ORDER_ATTRS:
             if attr in elem.attrib:
                 value = elem.attrib[attr].strip()
                 # Vérifier si ça ressemble à un numéro de commande
@@ -127,18 +351,42 @@ def find_order_number(root):
     
     return None, None
 
+# Balises corrigées sous PositionCharacteristics : (chemin, champ de la commande)
+POSITION_FIELDS = (
+    (('PositionStatus', 'Code'), 'StatutCode'),
+    (('PositionStatus', 'Description'), 'Statut'),
+    (('PositionLevel',), 'Classification'),
+    (('PositionCoefficient',), 'HRBP')
+)
+
+# Trouver ou créer un élément à partir de son chemin
+def ensure_path(parent, tags, corrections):
+    """Retourne l'élément au bout du chemin, en créant les balises manquantes"""
+    elem = parent
+    for depth, tag in enumerate(tags):
+        child = elem.find(tag)
+        if child is None:
+            child = ET.SubElement(elem, tag)
+            # Seules les balises directes de PositionCharacteristics sont signalées
+            if depth == 0:
+                corrections.append(f"Ajout de {tag}")
+        elem = child
+    return elem
+
 # Fonction pour corriger un XML
-def correct_xml(root, commande_data):
-    """Applique les corrections au XML"""
+def correct_xml(root, commande_data, pos_char=None):
+    """Applique les corrections au XML et indique si l'arbre a été modifié"""
     corrections = []
+    dirty = False
     
-    # Mapper les noms de colonnes possibles
-    statut_key = next((k for k in commande_data.keys() if 'statut' in k.lower()), 'Statut')
-    class_key = next((k for k in commande_data.keys() if 'class' in k.lower()), 'Classification')
-    hrbp_key = next((k for k in commande_data.keys() if 'hrbp' in k.lower()), 'HRBP')
+    def set_text(elem, value):
+        # Ne toucher au texte que s'il change réellement
+        nonlocal dirty
+        if elem.text != value:
+            elem.text = value
+            dirty = True
     
-    # Trouver ou créer PositionCharacteristics
-    pos_char = root.find(".//PositionCharacteristics")
+    # PositionCharacteristics est relevée au parsing : la créer si elle manque
     if pos_char is None:
         # Chercher où l'insérer (après certains éléments spécifiques si possible)
         insert_after = ['Header', 'OrderInfo', 'ContractInfo']
@@ -152,41 +400,16 @@ def correct_xml(root, commande_data):
         root.insert(insert_index, pos_char)
         corrections.append("Création de la section PositionCharacteristics")
     
-    # PositionStatus
-    pos_status = pos_char.find("PositionStatus")
-    if pos_status is None:
-        pos_status = ET.SubElement(pos_char, "PositionStatus")
-        corrections.append("Ajout de PositionStatus")
-    
-    # Extraire le code du statut (ex: "N2" de "N2 - Niveau 2 (4B +)")
-    statut_value = commande_data.get(statut_key, '')
-    code_value = statut_value.split()[0] if statut_value else ''
-    
-    code_elem = pos_status.find("Code")
-    if code_elem is None:
-        code_elem = ET.SubElement(pos_status, "Code")
-    code_elem.text = code_value
-    
-    desc_elem = pos_status.find("Description")
-    if desc_elem is None:
-        desc_elem = ET.SubElement(pos_status, "Description")
-    desc_elem.text = statut_value
-    
-    # PositionLevel
-    pos_level = pos_char.find("PositionLevel")
-    if pos_level is None:
-        pos_level = ET.SubElement(pos_char, "PositionLevel")
-        corrections.append("Ajout de PositionLevel")
-    pos_level.text = commande_data.get(class_key, '')
-    
-    # PositionCoefficient
-    pos_coef = pos_char.find("PositionCoefficient")
-    if pos_coef is None:
-        pos_coef = ET.SubElement(pos_char, "PositionCoefficient")
-        corrections.append("Ajout de PositionCoefficient")
-    pos_coef.text = commande_data.get(hrbp_key, '')
-    
-    return corrections
+    # Balises à renseigner, dans l'ordre de création
+    for tags, field in POSITION_FIELDS:
+        value = getattr(commande_data, field)
+        # Valeur absente ou cellule vide dans le CSV (NaN, seule valeur différente
+        # d'elle-même) : la balise est laissée telle quelle
+        if not value or value != value:
+            continue
+        set_text(ensure_path(pos_char, tags, corrections), value)
+    
+    return corrections, dirty or bool(corrections)
 
 # Fonction pour formater le XML avec indentation
 def prettify_xml(elem, level=0):
@@ -205,54 +428,103 @@ def prettify_xml(elem, level=0):
         if level and (not elem.tail or not elem.tail.strip()):
             elem.tail = indent
 
-# Interface principale
-col1, col2 = st.columns([1, 2])
-
-with col1:
-    st.subheader("📊 Base de données des commandes")
+# Correction d'un fichier en un seul parsing, résultat mis en cache par contenu
+@st.cache_data(show_spinner=False, max_entries=256)
+def correct_xml_bytes(xml_content, _lookup, lookup_key):
+    """Parse, corrige et sérialise un fichier XML.
     
-    df, error = load_data_from_github()
+    lookup_key identifie la version de la base : le cache est ignoré quand elle change.
+    Retourne (statut, numéro de commande, nombre de corrections, message, contenu corrigé ou None)
+    """
+    # L'arbre obtenu sert à la fois à la recherche du numéro et aux corrections
+    root, tag_hits, error = parse_xml_content(xml_content)
     
     if error:
-        st.error(error)
-        st.info("Utilisation des données de démonstration")
-        data = {
-            'Numéro de commande': ['000054', '000646'],
-            'Code agence': ['LV2-LV2', 'LV2-LV2'],
-            'Statut': ['N2 - Niveau 2 (4B +)', 'N1 - Niveau 1 (2A / 4A)'],
-            'Classification': ['04B - 225', '03B - 195 Equipe'],
-            'HRBP': ['Gabrielle Humbert', 'Houria Gherras']
-        }
-        df = pd.DataFrame(data)
+        return '❌ Erreur', '', 0, f"Erreur parsing: {error}", None
     
-    st.success(f"✅ {len(df)} commandes disponibles")
+    num_cmd, found_in = find_order_number(root, tag_hits)
     
-    # Afficher les données
-    st.dataframe(
-        df,
-        use_container_width=True,
-        hide_index=True
-    )
+    if not num_cmd:
+        return '⚠️ Non trouvé', '', 0, "Numéro de commande introuvable", None
     
-    # Informations sur les commandes
-    with st.expander("ℹ️ Commandes disponibles"):
-        # Vérifier le nom exact de la colonne
-        num_col = None
-        for col in df.columns:
-            if 'num' in col.lower() and 'commande' in col.lower():
-                num_col = col
-                break
+    # Chercher dans la base de données
+    commande_data = _lookup.get(num_cmd)
+    
+    if commande_data is None:
+        return '⚠️ Inconnu', num_cmd, 0, f"Commande {num_cmd} absente de la base", None
+    
+    corrections, dirty = correct_xml(root, commande_data, tag_hits.get("PositionCharacteristics"))
+    
+    if not dirty:
+        # Rien n'a changé : le fichier d'origine est rendu tel quel, sans resérialisation
+        return '✅ Déjà conforme', num_cmd, 0, f"Trouvé dans <{found_in}>", xml_content
+    
+    # Formater le XML avec indentation
+    prettify_xml(root)
+    
+    # Sauvegarder le fichier corrigé directement en octets UTF-8,
+    # prêts pour l'archive ZIP, sans passer par une chaîne Python
+    xml_bytes = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    xml_bytes += ET.tostring(root, encoding='utf-8', method='xml')
+    
+    return '✅ Corrigé', num_cmd, len(corrections), f"Trouvé dans <{found_in}>", xml_bytes
+
+# Traitement complet d'un fichier : lecture, pré-filtre puis correction
+def process_one(uploaded_file, lookup, lookup_key, order_needles):
+    """Traite un fichier XML.
+    
+    Retourne (statut, numéro de commande, nombre de corrections, message, contenu corrigé ou None)
+    """
+    try:
+        xml_content = uploaded_file.getvalue()
         
-        if num_col:
-            for num in df[num_col].unique():
-                row = df[df[num_col] == num].iloc[0]
-                hrbp = row.get('HRBP', 'N/A')
-                statut = row.get('Statut', 'N/A')
-                st.write(f"**{num}** → {hrbp} ({statut})")
-        else:
-            st.write("Colonnes disponibles:", list(df.columns))
+        # Aucun numéro connu dans le fichier : inutile de le parser
+        if not may_contain_known_order(xml_content, order_needles):
+            return '⚠️ Inconnu', '', 0, "Aucune commande connue dans le fichier", None
+        
+        return correct_xml_bytes(xml_content, lookup, lookup_key)
+        
+    except Exception as e:
+        return '❌ Erreur', '', 0, str(e), None
 
-with col2:
+# Noms des fichiers corrigés dans l'archive ZIP
+def build_entry_names(file_names):
+    """Retourne un nom d'entrée unique par fichier (suffixe _2, _3... si un nom se répète)"""
+    entry_names = []
+    seen = set()
+    for file_name in file_names:
+        entry_name = f"corrected_{file_name}"
+        if entry_name in seen:
+            stem, ext = os.path.splitext(entry_name)
+            counter = 2
+            while f"{stem}_{counter}{ext}" in seen:
+                counter += 1
+            entry_name = f"{stem}_{counter}{ext}"
+        seen.add(entry_name)
+        entry_names.append(entry_name)
+    return entry_names
+
+# Téléchargement d'un seul fichier corrigé, choisi dans l'archive ZIP
+@st.fragment
+def single_file_download(zip_data, names):
+    """Propose un fichier de l'archive au téléchargement"""
+    # Seul le fichier choisi est envoyé au navigateur ; changer de choix ne
+    # relance que ce bloc, les résultats du traitement restent affichés
+    pick = st.selectbox("Fichier", names)
+    with zipfile.ZipFile(BytesIO(zip_data)) as zf:
+        data = zf.read(pick)
+    st.download_button(
+        label=f"💾 {pick}",
+        data=data,
+        file_name=pick,
+        mime="application/xml"
+    )
+
+# Section de correction : exécutée en fragment, ses interactions (upload,
+# bouton) ne relancent pas le rendu de la base de données des commandes
+@st.fragment
+def correction_section(lookup):
+    """Affiche l'upload, le traitement et le téléchargement des fichiers XML"""
     st.subheader("📄 Correction des fichiers XML")
     
     # Upload multiple
@@ -276,93 +548,66 @@ with col2:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Variables pour les statistiques
-            results = []
-            corrected_files = []
-            total_corrections = 0
-            
             # Container pour les résultats
             results_container = st.container()
             
-            # Traiter chaque fichier
-            for idx, uploaded_file in enumerate(uploaded_files):
-                # Mettre à jour la progression
-                progress = (idx + 1) / len(uploaded_files)
-                progress_bar.progress(progress)
-                status_text.text(f"Traitement de {uploaded_file.name}... ({idx + 1}/{len(uploaded_files)})")
-                
-                # Résultat pour ce fichier
-                file_result = {
-                    'Fichier': uploaded_file.name,
-                    'Statut': '',
-                    'Numéro commande': '',
-                    'Corrections': 0,
-                    'Message': ''
+            # Numéros connus pour écarter les fichiers sans commande connue
+            order_needles = build_order_needles(lookup)
+            
+            # Empreinte de la base : les corrections en cache restent valables tant qu'elle ne change pas
+            lookup_key = hash(repr(lookup))
+            
+            # Traiter les fichiers en parallèle : lxml libère le GIL pendant
+            # le parsing et la sérialisation, les threads avancent donc ensemble
+            total_files = len(uploaded_files)
+            
+            # Résultats rangés par colonne, une case par fichier
+            files_col = [uploaded_file.name for uploaded_file in uploaded_files]
+            status_col = [''] * total_files
+            num_cmd_col = [''] * total_files
+            corrections_col = np.zeros(total_files, dtype=np.int32)
+            message_col = [''] * total_files
+            corrected_names = []
+            # Deux fichiers de même nom ne doivent pas s'écraser dans l'archive
+            entry_names = build_entry_names(files_col)
+            progress_step = max(1, total_files // 50)
+            
+            # Un thread par cœur disponible : le travail est essentiellement du C (libxml2)
+            max_workers = min(os.cpu_count() or 1, total_files)
+            
+            # L'archive ZIP est remplie au fil de l'eau : chaque fichier corrigé y
+            # est écrit dès qu'il est prêt, sans être conservé en mémoire à côté
+            # (compression minimale : la construction reste rapide)
+            zip_buffer = BytesIO()
+            
+            with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                    zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                futures = {
+                    executor.submit(process_one, uploaded_file, lookup, lookup_key, order_needles): idx
+                    for idx, uploaded_file in enumerate(uploaded_files)
                 }
                 
-                try:
-                    # Lire et parser le XML
-                    xml_content = uploaded_file.read()
-                    root, error = parse_xml_content(xml_content)
-                    
-                    if error:
-                        file_result['Statut'] = '❌ Erreur'
-                        file_result['Message'] = f"Erreur parsing: {error}"
-                        results.append(file_result)
-                        continue
-                    
-                    # Chercher le numéro de commande
-                    num_cmd, found_in = find_order_number(root)
-                    
-                    if not num_cmd:
-                        file_result['Statut'] = '⚠️ Non trouvé'
-                        file_result['Message'] = "Numéro de commande introuvable"
-                        results.append(file_result)
-                        continue
-                    
-                    file_result['Numéro commande'] = num_cmd
-                    
-                    # Chercher dans la base de données
-                    # Trouver la colonne numéro de commande
-                    num_col = None
-                    for col in df.columns:
-                        if 'num' in col.lower() and 'commande' in col.lower():
-                            num_col = col
-                            break
-                    
-                    if num_col and num_cmd not in df[num_col].values:
-                        file_result['Statut'] = '⚠️ Inconnu'
-                        file_result['Message'] = f"Commande {num_cmd} absente de la base"
-                        results.append(file_result)
-                        continue
-                    
-                    # Appliquer les corrections
-                    commande_data = df[df[num_col] == num_cmd].iloc[0].to_dict()
-                    corrections = correct_xml(root, commande_data)
-                    
-                    file_result['Statut'] = '✅ Corrigé'
-                    file_result['Corrections'] = len(corrections)
-                    file_result['Message'] = f"Trouvé dans <{found_in}>"
-                    total_corrections += len(corrections)
+                for done, future in enumerate(as_completed(futures), start=1):
+                    idx = futures[future]
+                    (
+                        status_col[idx],
+                        num_cmd_col[idx],
+                        corrections_col[idx],
+                        message_col[idx],
+                        xml_bytes
+                    ) = future.result()
                     
-                    # Formater le XML avec indentation
-                    prettify_xml(root)
+                    if xml_bytes is not None:
+                        corrected_name = entry_names[idx]
+                        zf.writestr(corrected_name, xml_bytes)
+                        corrected_names.append(corrected_name)
                     
-                    # Sauvegarder le fichier corrigé
-                    xml_str = '<?xml version="1.0" encoding="UTF-8"?>\n'
-                    xml_str += ET.tostring(root, encoding='unicode', method='xml')
-                    
-                    corrected_files.append({
-                        'name': uploaded_file.name,
-                        'content': xml_str,
-                        'original_name': uploaded_file.name
-                    })
-                    
-                except Exception as e:
-                    file_result['Statut'] = '❌ Erreur'
-                    file_result['Message'] = str(e)
-                
-                results.append(file_result)
+                    # Mettre à jour la progression (au plus ~50 rafraîchissements par lot)
+                    if done % progress_step == 0 or done == total_files:
+                        progress_bar.progress(done / total_files)
+                        status_text.text(f"{uploaded_files[idx].name} traité ({done}/{total_files})")
+            
+            total_corrections = int(corrections_col.sum())
             
             # Fin du traitement
             progress_bar.empty()
@@ -374,10 +619,10 @@ with col2:
             # Statistiques globales
             col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
             
-            total_files = len(results)
-            success_files = len([r for r in results if r['Statut'] == '✅ Corrigé'])
-            error_files = len([r for r in results if '❌' in r['Statut']])
-            warning_files = len([r for r in results if '⚠️' in r['Statut']])
+            # Fichiers corrigés ou déjà conformes
+            success_files = len([s for s in status_col if '✅' in s])
+            error_files = len([s for s in status_col if '❌' in s])
+            warning_files = len([s for s in status_col if '⚠️' in s])
             
             with col_stat1:
                 st.metric("Total traités", total_files)
@@ -389,35 +634,45 @@ with col2:
                 st.metric("Corrections", total_corrections)
             
             # Tableau détaillé des résultats
-            results_df = pd.DataFrame(results)
-            st.dataframe(
-                results_df,
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "Statut": st.column_config.TextColumn(width="small"),
-                    "Corrections": st.column_config.NumberColumn(width="small")
-                }
-            )
+            results_columns = {
+                'Fichier': files_col,
+                'Statut': status_col,
+                'Numéro commande': num_cmd_col,
+                'Corrections': corrections_col,
+                'Message': message_col
+            }
+            if total_files < 50:
+                # Peu de fichiers : un tableau statique suffit
+                st.table(results_columns)
+            else:
+                results_df = pd.DataFrame(results_columns)
+                st.dataframe(
+                    results_df,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "Statut": st.column_config.TextColumn(width="small"),
+                        "Corrections": st.column_config.NumberColumn(width="small")
+                    }
+                )
             
             # Section de téléchargement
-            if corrected_files:
+            if corrected_names:
                 st.markdown("### 💾 Télécharger les fichiers corrigés")
-                st.success(f"✅ {len(corrected_files)} fichier(s) prêt(s) au téléchargement")
+                st.success(f"✅ {len(corrected_names)} fichier(s) prêt(s) au téléchargement")
                 
-                # Créer des colonnes pour organiser les boutons
-                download_cols = st.columns(3)
+                zip_data = zip_buffer.getvalue()
+                st.download_button(
+                    label=f"📦 Télécharger les {len(corrected_names)} fichier(s) (ZIP)",
+                    data=zip_data,
+                    file_name="corrected_batch.zip",
+                    mime="application/zip",
+                    type="primary"
+                )
                 
-                for idx, file_data in enumerate(corrected_files):
-                    col_idx = idx % 3
-                    with download_cols[col_idx]:
-                        st.download_button(
-                            label=f"📥 {file_data['original_name']}",
-                            data=file_data['content'],
-                            file_name=f"corrected_{file_data['name']}",
-                            mime="application/xml",
-                            key=f"download_{idx}"
-                        )
+                # Téléchargement individuel à partir de l'archive
+                with st.expander("📄 Télécharger un fichier"):
+                    single_file_download(zip_data, corrected_names)
                 
                 # Rapport de traitement
                 with st.expander("📋 Rapport détaillé"):
@@ -426,11 +681,61 @@ with col2:
                     st.write(f"**Réussis:** {success_files}")
                     st.write(f"**Corrections appliquées:** {total_corrections}")
                     st.write("\n**Détails par fichier:**")
-                    for result in results:
-                        if result['Statut'] == '✅ Corrigé':
-                            st.write(f"- ✅ {result['Fichier']} - Commande {result['Numéro commande']} - {result['Corrections']} corrections")
+                    for name, statut, num_cmd, nb_corrections, message in zip(
+                        files_col, status_col, num_cmd_col, corrections_col, message_col
+                    ):
+                        if '✅' in statut:
+                            st.write(f"- ✅ {name} - Commande {num_cmd} - {nb_corrections} corrections")
                         else:
-                            st.write(f"- {result['Statut']} {result['Fichier']} - {result['Message']}")
+                            st.write(f"- {statut} {name} - {message}")
+
+# Interface principale
+col1, col2 = st.columns([1, 2])
+
+with col1:
+    st.subheader("📊 Base de données des commandes")
+    
+    df, num_col, lookup, stats, error = load_data_from_github()
+    
+    if error:
+        st.error(error)
+        st.info("Utilisation des données de démonstration")
+        data = {
+            'Numéro de commande': ['000054', '000646'],
+            'Code agence': ['LV2-LV2', 'LV2-LV2'],
+            'Statut': ['N2 - Niveau 2 (4B +)', 'N1 - Niveau 1 (2A / 4A)'],
+            'Classification': ['04B - 225', '03B - 195 Equipe'],
+            'HRBP': ['Gabrielle Humbert', 'Houria Gherras']
+        }
+        df = pd.DataFrame(data)
+        num_col = find_num_col(df)
+        lookup = build_commandes_lookup(df, num_col)
+        stats = build_commandes_stats(lookup)
+    
+    st.success(f"✅ {len(df)} commandes disponibles")
+    st.caption(f"{stats['total']} numéros distincts · {stats['agences']} agence(s) · {stats['hrbp']} HRBP")
+    
+    # Afficher les données à la demande : le tableau complet n'est envoyé
+    # au navigateur que si l'utilisateur le demande
+    if st.toggle("🗂️ Voir les données", value=False):
+        st.dataframe(
+            df,
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    # Informations sur les commandes
+    with st.expander("ℹ️ Commandes disponibles"):
+        if lookup:
+            for num, commande in lookup.items():
+                hrbp = commande.HRBP or 'N/A'
+                statut = commande.Statut or 'N/A'
+                st.write(f"**{num}** → {hrbp} ({statut})")
+        else:
+            st.write("Colonnes disponibles:", list(df.columns))
+
+with col2:
+    correction_section(lookup)
 
 # Pied de page
 st.markdown("---")